@@ -0,0 +1,78 @@
+"""Compiled (numba, optional dependency) kernels for valuation loops over CSR arrays, see `AssetGraph._init_nodes`"""
+from numpy import empty, searchsorted, float64
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:  # kernels still work as interpreted Python, but callers should prefer vectorized numpy instead
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):  # used as @njit
+            return args[0]
+        return lambda func: func        # used as @njit(...), e.g. with explicit signature (eager compilation)
+    prange = range
+
+DTYPES = ('float64', 'float32')  # of prices and weights, see `AssetGraph.dtype`
+
+
+@njit([f"void(intp[:], intp[:], {t}[:], {t}[:], intp[:], uint8[:], intp, intp[:], intp[:])" for t in DTYPES], cache=True)
+def revalue(indptr, asset_idx, weights, all_prices, portfolio_ids, dirty_mask, portfolio_offset,
+            parents_indptr, parents):
+    """Single sweep over portfolios (sorted ids, i.e. in topological order), values only those affected by new prices
+     (dirty) and clears their dirty flags. A portfolio lacking any price evaluates to NaN.
+     Fused with propagation: owners (see `AssetGraph.rcsr_parents`) of a portfolio are flagged only if its price
+     changed. Portfolio prices are located after stock prices, at `portfolio_offset` (number of stocks).
+     Accumulates in float64, the change is checked at stored precision (e.g. float32)"""
+    for i in portfolio_ids:
+        if not dirty_mask[i]:
+            continue
+        dirty_mask[i] = 0
+        acc = 0.0
+        for k in range(indptr[i], indptr[i + 1]):
+            acc += float(weights[k]) * float(all_prices[asset_idx[k]])
+        node = portfolio_offset + i
+        old_price = all_prices[node]
+        all_prices[node] = acc
+        new_price = all_prices[node]
+        if new_price == old_price or (new_price != new_price and old_price != old_price):  # unchanged (or NaN)
+            continue  # owners are not affected
+        for k in range(parents_indptr[node], parents_indptr[node + 1]):
+            dirty_mask[parents[k] - portfolio_offset] = 1
+
+
+@njit([f"float64({t}[:], intp[:], {t}[:])" for t in DTYPES], cache=True)
+def gather_dot(all_prices, asset_idx, weights):
+    """Value of a single portfolio (see `Portfolio.update_value`): fused gather and dot product, without allocating
+     the gathered prices (`Portfolio.asset_prices`) or NumPy call overhead, which dominate for small portfolios"""
+    acc = 0.0
+    for k in range(asset_idx.shape[0]):
+        acc += float(weights[k]) * float(all_prices[asset_idx[k]])
+    return acc
+
+
+@njit("void(intp, intp[:], intp, intp[:], intp[:], float64[:], float64[:])", cache=True)
+def propagate_deltas(start, ancestor_ids, n_stocks, parents_indptr, parents, weights, deltas):
+    """Deltas of ancestors (sorted portfolio ids, see `AssetGraph._init_ancestors`) of a single stock at `start`: sum
+     over all ownership paths of products of weights. A single sweep over ancestors only (in topological order, so
+     that a node owned via several paths is counted via each of them), `deltas` is aligned with `ancestor_ids`"""
+    deltas[:] = 0.0
+    for k in range(parents_indptr[start], parents_indptr[start + 1]):
+        deltas[searchsorted(ancestor_ids, parents[k] - n_stocks)] += weights[k]
+    for i in range(ancestor_ids.shape[0]):
+        node, delta = n_stocks + ancestor_ids[i], deltas[i]  # final: all assets on the paths from the stock swept
+        for k in range(parents_indptr[node], parents_indptr[node + 1]):
+            deltas[searchsorted(ancestor_ids, parents[k] - n_stocks)] += delta * weights[k]
+
+
+@njit("float64[:](intp, intp[:], intp[:], intp[:], intp[:], float64[:])", parallel=True, cache=True)
+def propagate_all_deltas(n_stocks, ancestor_indptr, ancestor_ids, parents_indptr, parents, weights):
+    """Deltas of portfolios to each stock (see `propagate_deltas`) in compressed columns (CSC) with the same layout
+     as ancestors of stocks (`ancestor_indptr[:n_stocks + 1]`, `ancestor_ids`). Stocks are independent, swept in
+     parallel, each into its own (preallocated) column, so that threads never write shared data"""
+    values = empty(ancestor_indptr[n_stocks], dtype=float64)
+    for stock in prange(n_stocks):
+        start, end = ancestor_indptr[stock], ancestor_indptr[stock + 1]
+        propagate_deltas(stock, ancestor_ids[start:end], n_stocks, parents_indptr, parents, weights,
+                         values[start:end])
+    return values
@@ -1,4 +1,11 @@
+import csv
 import time
+from contextlib import nullcontext
+
+try:  # optional (Linux only), to wait for file modification instead of polling
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
 
 
 def read_csv_portfolios_weights(filename):
@@ -8,19 +15,19 @@ def read_csv_portfolios_weights(filename):
 
     :filename: str or pathlib.Path for file to read data from
     """
-    with open(filename, 'r') as file:
-        header = next(file).strip().split(',')
+    with open(filename, 'r', newline='', buffering=1 << 20) as file:
+        rows = csv.reader(file)  # single C-level tokenization of each line
+        header = next(rows)
         if (header[0].strip().upper() != "NAME") or \
            (header[1].strip().upper() != "SHARES"):
             raise ValueError(f"Header {header} does not match expected format: 'NAME, SHARES'")
         block = []  # to store portfolio chunks (definition: name and components with weights)
 
-        for line in file:
-            line = line.strip()
-            if not line:  # to handle or, for now, skip empty line or EOF
+        for line_items in rows:
+            line_items = [item.strip() for item in line_items]
+            if not any(line_items):  # to handle or, for now, skip empty (or blank) line or EOF
                 continue
 
-            line_items = line.split(',')
             if len(line_items) == 1 or len(line_items[1]) == 0:  # new portfolio block
                 if block:  # yield the previous block if it exists
                     yield block
@@ -28,37 +35,78 @@ def read_csv_portfolios_weights(filename):
             elif len(line_items) == 2:   #  or append to existing if read component and weight
                 block.append(line_items)
             else:
-                raise ValueError(f"expected one or two line items, got: {line}")
+                raise ValueError(f"expected one or two line items, got: {line_items}")
 
         if block:  # at EOF, yield the last block
             yield block
 
 
-def streamin_csv_prices(filename):
-    """Reads in price data from file (e.g. CSV), and then follows the file for updates (new appends)"""
+def read_csv_portfolios_arrays(filename):
+    """Read portfolio data (same format as `read_csv_portfolios_weights`) into flat edge lists,
+    e.g. for `AssetGraph.from_arrays`
+
+    :filename: str or pathlib.Path for file to read data from
+    :return: names, quantities and parents (portfolio names) of all components, and all declared portfolio names
+     (incl. those without components)
+    """
+    names, qtys, parents, portfolios = [], [], [], []
+    for block in read_csv_portfolios_weights(filename):
+        portfolio_name = block[0]
+        if not portfolio_name:
+            raise ValueError(f"Invalid portfolio name, {portfolio_name}")
+        portfolios.append(portfolio_name)
+        for ticker, quantity in block[1:]:
+            names.append(ticker)
+            qtys.append(float(quantity))
+            parents.append(portfolio_name)
+    return names, qtys, parents, portfolios
+
+
+def streamin_csv_prices(filename, mark_batches=False):
+    """Reads in price data from file (e.g. CSV), and then follows the file for updates (new appends).
+    With inotify (optional inotify_simple package) waits for file modification, otherwise polls the file
 
-    def _get_line_items(line):
-        line_items = line.strip().split(",")  # just an example of validation (2 items or 3 if the last is empty str)
-        if not (len(line_items) == 2 or (len(line_items) == 3 and not line_items[2])):
-            raise ValueError(f"Expected two line items, got: {line}")
+    :filename: str or pathlib.Path for file to read data from
+    :mark_batches: yield None whenever caught up with the file (marks end of a batch of prices),
+     e.g. for `AssetGraph.update_prices_from(..., batched=True)`
+    """
+
+    def _get_line_items(line_items):
+        # just an example of validation (2 items or 3 if the last is empty str)
+        line_items = [item.strip() for item in line_items]
+        if len(line_items) not in (2, 3) or (len(line_items) == 3 and line_items[2]):
+            raise ValueError(f"Expected two line items, got: {line_items}")
         return line_items[:2]
 
-    with open(filename, 'r') as file:
-        header = next(file)
-        header_items = _get_line_items(header)
+    with open(filename, 'r', newline='', buffering=1 << 20) as file, \
+         (INotify() if INotify is not None else nullcontext()) as watcher:
+        if watcher is not None:
+            watcher.add_watch(filename, flags.MODIFY)
+        rows = csv.reader(file)  # stateful iterator, reused to follow the file after reaching its end
+        header_items = _get_line_items(next(rows))
         if (header_items[0].strip().upper() != "NAME") or \
            (header_items[1].strip().upper() != "PRICE"):
-            raise ValueError(f"Header {header} does not match expected format: 'NAME, PRICE'")
+            raise ValueError(f"Header {header_items} does not match expected format: 'NAME, PRICE'")
+
+        for line_items in rows:  # reads existing lines upon initialization, stops if no more lines
+            if any(item.strip() for item in line_items):  # skip empty (or blank) line
+                yield _get_line_items(line_items)
 
-        while True:
-            line = file.readline()  # reads existing lines upon initialization
-            if not line:
-                break  # stops if no more lines
-            yield _get_line_items(line)
+        if mark_batches:
+            yield None  # end of batch
 
+        is_batch_pending = False
         while True:  # after initialization, wait for new lines
-            line = file.readline()
-            if not line:
-                time.sleep(0.1)  # to limit IO
+            line_items = next(rows, None)
+            if line_items is None:
+                if is_batch_pending and mark_batches:  # caught up with the file, end of batch
+                    is_batch_pending = False
+                    yield None
+                if watcher is not None:
+                    watcher.read(timeout=1000)  # blocks until appended to, timeout (ms) is only a safety net
+                else:
+                    time.sleep(0.1)  # to limit IO
                 continue
-            yield _get_line_items(line)
+            if any(item.strip() for item in line_items):  # skip empty (or blank) line
+                is_batch_pending = True
+                yield _get_line_items(line_items)
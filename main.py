@@ -7,15 +7,18 @@ from data_io import read_csv_portfolios_weights, streamin_csv_prices
 
 generator_portfolios = read_csv_portfolios_weights("./example_data/portfolios.csv")
 
-simUniverse = AssetGraph(stdout=open("./example_data/portfolio_prices.csv", 'a'))
+simUniverse = AssetGraph(stdout=open("./example_data/portfolio_prices.csv", 'a', buffering=1 << 16))
 simUniverse.add_components_from(generator_portfolios)
+# from data_io import read_csv_portfolios_arrays  # alternative, bulk
+# simUniverse = AssetGraph.from_arrays(*read_csv_portfolios_arrays("./example_data/portfolios.csv"), stdout=...)
 
 simUniverse.init_components(est_risk_factors=True)  # finished defining portfolios
 # simUniverse.init_components()  # slower alternative, defaulting to est_risk_factors=False
 
 
-generator_prices = streamin_csv_prices("./example_data/prices.csv")
+generator_prices = streamin_csv_prices("./example_data/prices.csv", mark_batches=True)  # writes output when idle
 simUniverse.update_prices_from(generator_prices)  # streams continuously, press Ctrl-C to stop
+# simUniverse.update_prices_from(generator_prices, batched=True)  # alternative, values all portfolios once per batch
 
 
 
@@ -1,19 +1,28 @@
+import csv
 import sys
-from collections import ChainMap, deque
-from weakref import proxy, ProxyType
+from collections import defaultdict, deque
 
-from numpy import nan, isnan, array, ndarray, full, dot, zeros
+from numpy import nan, isnan, array, ndarray, full, dot, zeros, empty, bincount, repeat, arange, cumsum, \
+    concatenate, unique, flatnonzero, fromiter, asarray, argsort, take, add, intp, float64, uint8, dtype as numpy_dtype
 from typing import Iterable
 from abc import ABCMeta, abstractmethod
 
+from _kernels import revalue, gather_dot, propagate_all_deltas, NUMBA_AVAILABLE, DTYPES
+
 
 class Component(metaclass=ABCMeta):
     """Composite design pattern to universally represent graph Nodes (whether stocks or portfolios)"""
-    def __init__(self, name: str, idx: int, price_refidx: int, graph: ProxyType):
+    __slots__ = ('name', 'id', 'price_refidx', 'graph', 'is_active', 'ancestors_topo', 'owner_ids', 'ancestor_ids')  # no `__dict__`
+
+    def __init__(self, name: str, idx: int, price_refidx: int, graph: 'AssetGraph'):
         self.name = name
         self.id = idx  # unlike price_refidx, this id (index) is separate portfolio or stock (both start from 0s)
         self.price_refidx = price_refidx
         self.graph = graph
+        self.is_active = False  # has a price (set once, see `self.count_first_price`), to avoid NaN tests of own price
+        self.ancestors_topo = []  # affected portfolios (in topological order), see `AssetGraph._init_topo_order`
+        self.owner_ids = []  # ids of (direct) parent portfolios
+        self.ancestor_ids = zeros(0, dtype=intp)  # same as `self.ancestors_topo`, for compiled or vectorized code
 
     @property
     def price(self) -> float:
@@ -22,86 +31,158 @@ class Component(metaclass=ABCMeta):
 
     @price.setter
     def price(self, value: float):
-        if self.price != value:
-            self.graph.all_prices[self.price_refidx] = value
-            print(self, file=self.graph.stdout, flush=True)
+        prices, refidx = self.graph.all_prices, self.price_refidx  # no property dispatch
+        old_value = prices.item(refidx)  # builtin float, no numpy scalar compare
+        if old_value != value and (old_value == old_value or value == value):  # changed, but not NaN to NaN
+            prices[refidx] = value
+            if old_value != old_value and value == value:  # NaN to a number (NaN self-compare, no numpy dispatch)
+                self.count_first_price()
+            self.mark_owners_changed()
+            self.print_value()
+
+    def mark_owners_changed(self):
+        """Owners have a changed input price in the current generation, see `Portfolio.update_value`"""
+        generation, portfolios = self.graph.generation, self.graph.portfolios_list
+        for owner_id in self.owner_ids:
+            portfolios[owner_id].input_gen = generation
+
+    def count_first_price(self):
+        """Owners lack one input price less, see `Portfolio.n_nan_inputs`"""
+        self.is_active = True
+        for owner_id in self.owner_ids:
+            self.graph.portfolios_list[owner_id].n_nan_inputs -= 1
 
     def __str__(self):
         return f"{self.name},{self.price}"
 
+    def print_value(self):
+        """Buffered CSV output (same as `str(self)`), flushed every `AssetGraph.flush_every` price updates, see
+         `AssetGraph.end_update`. Skipped unless `AssetGraph.verbose`"""
+        graph = self.graph
+        if graph.verbose:  # at stored precision, e.g. float32 43.29 instead of 43.290000915527344
+            price = float(self.price) if graph.dtype is float64 else str(graph.dtype(self.price))
+            graph.csv_writer.writerow((self.name, price))
+
     @abstractmethod
     def update_value(self):
         pass
 
     def update_parent_values(self):
-        """BFS (bottom-up) price updates for only affected portfolios and only if all input prices are present
-        This is implementation of 1st approach, traversal on every stock price update.
+        """Price updates (bottom-up) for only affected portfolios and only if all input prices are present.
+        This is implementation of 1st approach, a single sweep on every stock price update over ancestors cached in
+         topological order (see `AssetGraph._init_topo_order`), so a sub-portfolio is always valued before its owners.
         See `update_owners_deltas` for 2nd approach, where value_difference is used for incremental update using pre-
          computed factors (traversal is done at `AssetGraph.init_components`). Also, see `AssetGraph.stock_deltas`).
         In multi-processing env can lock the tree being updated and only allow updates on disconnected subgraphs"""
 
-        visited = [self.name]  # BFS visited nodes. name, weight (placeholder for 0th node)
-        queue = deque([self.name])  # BFS queue without weights
-        status = True  # early stop for BFS (affected nodes after a node that can't be priced)
-
-        while queue:
-            node = queue.popleft()  # collections.deque.popleft() is faster than list.pop(0)
-            if node != self.name:  # evaluate parent portfolios using cumulative (product of prior) weights:
-                # incremental update abandoned after own test cases (both direct and indirect ownership)
-                status = self.graph.portfolios[node].update_value()  # value_difference is used in approach 2, see help
-            if status:
-                for parent in self.graph.merged_view[0][node]:  # over stock/portfolio owners
-                    if parent not in visited:
-                        visited.append(parent)
-                        queue.append(parent)
-
-    def update_owners_deltas(self):
-        """BFS (bottom-up) delta (incremental) updates for only affected portfolios.
-        No early stopping unlike `self.update_parent_values`. """
-        visited = [self.name]  # BFS visited nodes. name, weight (placeholder for 0th node)
-        queue = deque([(self.name, 1)])  # double-ended queue for BFS with weights (cumulative product along the ownership path)
-
-        stock_name, stock_id = self.name, self.id  # name and index (used for navigation)
-        while queue:
-            node_name, current_weight = queue.popleft()  # collections.deque.popleft() is faster than list.pop(0)
-            if node_name != stock_name:  # calculate parent portfolio delta as cumulative (product of prior) weights:
-                self.graph.portfolios[node_name].set_delta(stock_id, delta=current_weight)
-            for parent, weight in zip(self.graph.merged_view[0][node_name],
-                                      self.graph.merged_view[1][node_name]):
-                if parent not in visited:  # this works as between 2 layers there's only 1 edge, but stock can be owned
-                    visited.append(parent)  # ... both directly and indirectly at the same time (by same portfolio)
-                    queue.append((parent, current_weight * weight))
+        if NUMBA_AVAILABLE:  # compiled sweep over the same (cached) ancestors
+            self.graph.dirty_mask[self.owner_ids] = 1
+            self.graph.flush_prices(self.ancestor_ids)
+            return
+
+        pruned = bytearray(len(self.graph.portfolios))  # early stop: owners of a portfolio that can't be priced
+        for portfolio in self.ancestors_topo:
+            if pruned[portfolio.id] or not portfolio.revalue():
+                for owner_id in portfolio.owner_ids:  # can't be priced either (sub-portfolio price is missing)
+                    pruned[owner_id] = 1
+
+    def update_owners_deltas(self, deltas: ndarray):
+        """Deltas of all affected portfolios to this stock, a single sweep (bottom-up) over ancestors cached in
+         topological order, so that a portfolio's delta is complete before it's passed on to its owners. Unlike BFS
+         with visited nodes, a portfolio that owns the stock via several paths (e.g. both directly and indirectly)
+         sums products of weights over all of them. Same as compiled `_kernels.propagate_deltas`.
+        :param deltas: buffer to fill, aligned with `self.ancestor_ids`
+        """
+        graph = self.graph  # locals bound once, instead of attribute lookups per iteration
+        indptr, parents, weights = graph.rcsr_indptr, graph.rcsr_parents, graph.rcsr_weights
+        start_refidx = self.price_refidx
+        node_deltas = {start_refidx: 1.0}  # cumulative (sum of products of prior) weights, by price refidx
+        get_delta = node_deltas.get
+        ancestor_refidxs = (graph.n_stocks + self.ancestor_ids).tolist()
+        for node_refidx in (start_refidx, *ancestor_refidxs):
+            delta = node_deltas[node_refidx]  # final: all assets of the node on the paths from the stock were swept
+            start, end = indptr[node_refidx], indptr[node_refidx + 1]
+            for parent, weight in zip(parents[start:end].tolist(), weights[start:end].tolist()):
+                node_deltas[parent] = get_delta(parent, 0.0) + delta * weight
+        deltas[:] = [node_deltas[i] for i in ancestor_refidxs]
 
 
 class Stock(Component):
+    __slots__ = ('_last',)
+
+    def __init__(self, name: str, idx: int, price_refidx: int, graph: 'AssetGraph'):
+        super().__init__(name, idx, price_refidx, graph)
+        self._last = nan  # own price as builtin float (mirrors `AssetGraph.all_prices`), to avoid ndarray reads
+
+    @property
+    def price(self) -> float:
+        return self._last
+
+    @price.setter
+    def price(self, value: float):
+        """Typed store into `AssetGraph.all_prices`, change is checked by C-level compare of builtin floats"""
+        graph = self.graph
+        if graph.dtype is not float64:  # rounded as stored, so that `self._last` mirrors `AssetGraph.all_prices`
+            value = float(graph.dtype(value))
+        old_value = self._last
+        if old_value != value:
+            self._last = value
+            graph.all_prices[self.price_refidx] = value
+            if old_value != old_value and value == value:  # NaN to a number
+                self.count_first_price()
+            self.mark_owners_changed()
+            self.print_value()
+
+    def count_first_price(self):
+        """Also affected portfolios lack one ultimate underlying price less (2nd valuation approach), whether
+         the price came from `self.update_value` or a batch (`AssetGraph.update_prices`)"""
+        super().count_first_price()
+        graph = self.graph
+        if graph.stock_deltas is not None:
+            start, end = graph.delta_indptr[self.id], graph.delta_indptr[self.id + 1]
+            for portfolio_id in graph.delta_portfolios[start:end].tolist():
+                graph.portfolios_list[portfolio_id].n_px_to_value -= 1
+
     def update_value(self, new_value: int | float):
-        old_value = self.price
+        if self.graph.topo_order is None:  # nodes and arrays are stale, see `AssetGraph.add_component`
+            self.graph.check_initialized()
+        if self.graph.dtype is not float64:  # rounded as stored (see `self.price`), e.g. for `value_difference`
+            new_value = float(self.graph.dtype(new_value))
+        old_value = self._last
+        if new_value == old_value:  # nothing to propagate
+            return
+        self.graph.generation += 1  # new price, see `Component.mark_owners_changed`
         self.price = new_value
 
         value_difference = new_value - old_value
-        is_first_price = isnan(value_difference)
-        stock_id = self.id
-        if self.graph.stock_deltas is not None and stock_id < self.graph.stock_deltas.shape[1]:  # approach 2
+        is_first_price = value_difference != value_difference  # NaN
+        stock_id, graph = self.id, self.graph
+        if graph.stock_deltas is not None:  # approach 2
             # efficiently update only affected portfolios using deltas without traversal (done at init stage)
-            for portfolio_id, delta_s in enumerate(self.graph.stock_deltas[:, stock_id]):
-                if delta_s:  # !=0 => affected portfolio
-                    portfolio_name = list(self.graph.portfolios.keys())[portfolio_id]
-                    if is_first_price:
-                        self.graph.portfolios[portfolio_name].n_px_to_value -= 1
-                        self.graph.portfolios[portfolio_name].update_value(self.price * delta_s)
-                    else:
-                        self.graph.portfolios[portfolio_name].update_value(value_difference * delta_s)
+            start, end = graph.delta_indptr[stock_id], graph.delta_indptr[stock_id + 1]  # ancestors only
+            portfolios = graph.portfolios_list
+            price_change = new_value if is_first_price else value_difference  # from 0 on first price
+            for portfolio_id, delta_s in zip(graph.delta_portfolios[start:end].tolist(),
+                                             graph.stock_deltas[start:end].tolist()):
+                portfolios[portfolio_id].update_value(price_change * delta_s)  # counted in `self.count_first_price`
         else:  # approach 1
             self.update_parent_values()
+        self.graph.end_update()  # single write of all updated prices
 
 
 class Portfolio(Component):
-    def __init__(self, name: str, idx: int, price_refidx: int, graph: ProxyType):
+    __slots__ = ('assets', 'weights', 'slice', 'n_nan_inputs', 'n_px_to_value', 'input_gen', 'computed_gen')
+
+    def __init__(self, name: str, idx: int, price_refidx: int, graph: 'AssetGraph'):
         super().__init__(name, idx, price_refidx, graph)
-        # lists of (normally) ints:
-        self.assets = []  # all
+        # views into `AssetGraph.csr_assets` and `.csr_weights`, see `AssetGraph._init_nodes`
+        self.assets = []  # price refidx of all (direct) assets: stocks and sub-portfolios
         self.weights = []
+        self.slice = slice(0)  # location of own assets and weights in `AssetGraph.csr_assets`, `.csr_weights`
+        self.n_nan_inputs = 0  # number of missing (direct) asset prices, see `Component.count_first_price`
         self.n_px_to_value = 0  # stocks prices counter: number of ultimate underlying price required to value self
+        # memoization: `AssetGraph.generation` of the last change of any (direct) asset price, and of own valuation
+        self.input_gen, self.computed_gen = 0, -1
 
     @property
     def asset_prices(self) -> ndarray:
@@ -109,49 +190,99 @@ class Portfolio(Component):
 
     def update_value(self, value_difference: int | float = nan) -> bool:
         """
-        Evaluate portfolio if possible. Supports fully recomputing portfolio value or an
-        incremental update from a single new asset price (value_difference already is weight multiplied).
+        Evaluate portfolio if possible (2nd valuation approach, see `Stock.update_value`). Supports an incremental
+        update from a single new asset price (value_difference already is weight multiplied), or fully recomputing
+        portfolio value once all ultimate underlying stock prices are present.
         :return: bool True if successful valuation or False if lacks one or more stock prices
         """
         # print(f"...evaluating {self.name}")
-        if not isnan(self.price) and not isnan(value_difference):
-            self.price += value_difference
-        elif self.graph.stock_deltas is None and any(isnan(self.asset_prices)):  # O(n) in 1st valuation approach
+        if self.is_active and value_difference == value_difference:  # not NaN (faster than numpy isnan on scalars)
+            self.price = self.price + value_difference
+            return True
+        if self.n_px_to_value > 0:  # O(1) in 2nd approach (single traversal)
             return False
-        elif self.n_px_to_value > 0:  # O(1) in 2nd approach (single traversal)
+        return self._recompute()
+
+    def revalue(self) -> bool:
+        """Fully recomputes portfolio value if possible (1st valuation approach, see `Component.update_parent_values`),
+         specialized instead of per-call checks of the approach in use (`self.update_value`)
+        :return: bool True if successful valuation or False if lacks one or more (direct) asset prices
+        """
+        if self.n_nan_inputs:  # O(1) in 1st valuation approach (counter)
             return False
-        else:  # first time value calculated (all component prices are present)
-            self.price = dot(self.asset_prices, self.weights)
+        return self._recompute()
+
+    def _recompute(self) -> bool:
+        """Value from all (direct) asset prices, which are present"""
+        if self.computed_gen == self.input_gen:  # asset prices unchanged since last valuation, keep price
+            return True
+        if NUMBA_AVAILABLE:
+            self.price = gather_dot(self.graph.all_prices, self.assets, self.weights)
+        else:  # gather into a preallocated buffer (single-threaded), instead of a new array per `self.asset_prices`
+            prices = take(self.graph.all_prices, self.assets, out=self.graph.scratch[:len(self.assets)])
+            self.price = dot(prices, self.weights)
+        self.computed_gen = self.input_gen
         return True
 
-    def set_delta(self, stock_id: int, delta: int | float = nan) -> None:
-        """Update cumulative (product) delta of the ultimate underlying stock"""
-        # print(f"...evaluating {self.name}")
-        # update "total" delta: from 0 or increment existing delta (via one portfolio path) with new one (via another ownership path)
-        portfolio_id = self.id
-        if self.graph.stock_deltas[portfolio_id, stock_id] == 0:
-            self.n_px_to_value += 1  # new stock (ultimate underlying) portfolio depends on
-        self.graph.stock_deltas[portfolio_id, stock_id] += delta  # portfolios in rows, price_refidx == P deltas rindex
-
 
 class AssetGraph:
 
     """To represent and implement what can be disconnected subgraphs of stocks and
     (optionally other portfolios) belonging to portfolios"""
 
-    def __init__(self, stdout=sys.stdout):
+    def __init__(self, stdout=sys.stdout, verbose=True, dtype=float64, flush_every=1):
         """Adjacency lists (representation) and Nodes (implementation) for later:
-            filling (add components, edges) and two-step initialization (creating and linking node instances)"""
+            filling (add components, edges) and initialization (creating and linking node instances)"""
         self.stocks = {}      # leaves in a tree-like graph, actual nodes. stocks and portfolio are separated mostly for clarity
         self.portfolios = {}  # non-leaves in a tree-like graph, actual nodes including "roots" (top-level portfolios if needed)
         # intermediate structures, from which graph is later constructed:
-        self.adj_list_parents_stocks = {}         # key names and values are parents (portfolios)
-        self.adj_list_parents_stock_weights = {}  # identical structure for weights (dicts and values, which are lists, both are ordered in Python)
-        self.adj_list_parents_portfolios = {}  # keys are (sub)portfolio names, values are lists of parent portfolios
-        self.adj_list_parents_portfolio_weights = {}
+        self.adj_list_parents_stocks = defaultdict(list)         # key names and values are parents (portfolios)
+        self.adj_list_parents_stock_weights = defaultdict(list)  # identical structure for weights (dicts and values, which are lists, both are ordered in Python)
+        self.adj_list_parents_portfolios = defaultdict(list)  # keys are (sub)portfolio names, values are lists of parent portfolios
+        self.adj_list_parents_portfolio_weights = defaultdict(list)
+        self._merged_view = None  # cache, see `self.merged_view`
+        self.parents, self.parent_weights = {}, {}  # merged view (all components) at `self.init_components`
         # self.incomplete_stocks = set()  # for lazy initialization of evaluation DAGs (keep track of partial graphs that can be made complete as new prices appear)
         self.stdout = stdout  # work-around to print (append) to file, defaults to console
-        self.stock_deltas = None  # see `self.init_components`
+        self.csv_writer = csv.writer(stdout, lineterminator='\n')  # buffered by stdout, see `Component.print_value`
+        self.flush_every = flush_every  # price updates per write (syscall), 1: as they happen, e.g. for `tail -f`.
+        # > 1: see end of batch in `self.update_prices_from`
+        self.n_unflushed = 0  # see `self.end_update`
+        self.verbose = verbose  # print updated prices (the tool's output); off to only keep `self.all_prices` current
+        if numpy_dtype(dtype).name not in DTYPES:  # compiled kernels only have these signatures
+            raise ValueError(f"dtype must be one of {DTYPES}, got: {numpy_dtype(dtype).name}")
+        self.dtype = numpy_dtype(dtype).type  # of prices and weights, e.g. float32 halves memory traffic (~7 digits)
+        self.stock_deltas = None  # sparse deltas (2nd valuation approach), see `self._init_deltas`
+        self.topo_order = None  # portfolio names, sub-portfolios before their owners. see `self._init_topo_order`
+        self.depth = 0  # number of levels of nested portfolios, i.e. passes needed by `self.flush_prices`
+        self.dense_weights = None  # small and dense graphs only, see `self.reprice_all`
+        self.level_bounds = [0]  # portfolio ids of each level start at `[level - 1]` and end at `[level]`
+        self.generation = 0  # counter of stock price updates, see `Portfolio.update_value`
+
+    @classmethod
+    def from_arrays(cls, names, qtys, parents, portfolios=(), **kwargs) -> 'AssetGraph':
+        """Alternative to `self.add_components_from`, fills adjacency lists in one pass over edges grouped by a
+         single (stable) sort, instead of list appends per row. E.g. see `data_io.read_csv_portfolios_arrays`
+        :param names: components (stocks or sub-portfolios), one per edge
+        :param qtys: quantities (weights) of components
+        :param parents: owning portfolio of each component
+        :param portfolios: declared portfolio names, incl. those without components (which have no edges)
+        :param kwargs: passed to `AssetGraph.__init__`
+        """
+        graph = cls(**kwargs)
+        names, qtys, parents = asarray(names, dtype=str), asarray(qtys, dtype=float64), asarray(parents, dtype=str)
+        for portfolio in dict.fromkeys((*portfolios, *unique(parents).tolist())):  # unique, declaration order first
+            graph.adj_list_parents_portfolios[portfolio] = []
+            graph.adj_list_parents_portfolio_weights[portfolio] = []
+        if len(names) == 0:  # no edges
+            return graph
+        order = argsort(names, kind='stable')  # per component, parents are kept in input order
+        names, qtys, parents = names[order], qtys[order], parents[order]
+        bounds = concatenate((flatnonzero(concatenate(([True], names[1:] != names[:-1]))), [len(names)]))
+        for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):  # contiguous range per component
+            graph.adj_list_parents_stocks[str(names[start])] = parents[start:end].tolist()
+            graph.adj_list_parents_stock_weights[str(names[start])] = qtys[start:end].tolist()
+        return graph  # sub-portfolios are reclassified later by `self.fix_structure`
 
     def add_components_from(self, data_provider: Iterable):
         """Interface, e.g. generator (better, lazy), ensures that the graph class is decoupled from the input source,
@@ -179,73 +310,328 @@ class AssetGraph:
         """Only fills adjacency lists, actual initialization of nodes is done later so that each node is created only once"""
         assert (parent is None) ^ (qty is not None), \
             "per example data: stock always belong to some portfolio and have quantity"
+        self.topo_order = None  # nodes (if initialized) are stale, price updates raise until `init_components`
+        self._merged_view = None
         if parent is not None:
-            if name in self.adj_list_parents_stocks:  # can be improved to treat duplicate info (repeated edge)
-                self.adj_list_parents_stocks[name].append(parent)
-                self.adj_list_parents_stock_weights[name].append(qty)  # can be a "subportfolio", not efficient to check here, instead will get reclassifed in self.fix_structure()
-            else:
-                self.adj_list_parents_stocks[name] = [parent]  # these 2 lines won't be needed for defaultdict implementation
-                self.adj_list_parents_stock_weights[name] = [qty]
-        else:
-            if name not in self.adj_list_parents_portfolios:
-                self.adj_list_parents_portfolios[name] = []  # defaultdict can be used as alternative implementation, but requires more changes
-                self.adj_list_parents_portfolio_weights[name] = []
+            self.adj_list_parents_stocks[name].append(parent)  # can be improved to treat duplicate info (repeated edge)
+            self.adj_list_parents_stock_weights[name].append(qty)  # can be a "subportfolio", not efficient to check here, instead will get reclassifed in self.fix_structure()
+        elif name not in self.adj_list_parents_portfolios:  # declaration only, no edge yet
+            self.adj_list_parents_portfolios[name] = []
+            self.adj_list_parents_portfolio_weights[name] = []
 
-    def update_prices_from(self, data_provider: Iterable):
+    def update_prices_from(self, data_provider: Iterable, batched: bool = False):
         """Interface, e.g. generator (better, lazy), ensures that the graph class is decoupled from the input source,
-         e.g. prices.csv, or other data streamed in line-by-line, or (non-lazy) in-memory container like List."""
-        for (ticker, price) in data_provider:
-            self.stocks[ticker].update_value(float(price))
+         e.g. prices.csv, or other data streamed in line-by-line, or (non-lazy) in-memory container like List.
+        :param batched: collect stock prices until the provider signals end of batch (None item, e.g. caught up with
+         the file in `streamin_csv_prices(..., mark_batches=True)`) or is exhausted, then apply them at once with
+         `self.update_prices`. End of batch also writes buffered output, so with `flush_every > 1` the provider
+         should signal it (otherwise up to `flush_every - 1` updates stay buffered while the input is idle)
+        """
+        pending = {}  # batch of prices, repeated tickers are coalesced (last price kept)
+        for line_items in data_provider:
+            if line_items is None:  # end of batch
+                if pending:
+                    self.update_prices(pending)
+                    pending = {}
+                self.flush()  # e.g. caught up with the input, see `self.flush_every`
+                continue
+            ticker, price = line_items
+            if batched:
+                pending[ticker] = float(price)
+            else:
+                self.stocks[ticker].update_value(float(price))
+        if pending:
+            self.update_prices(pending)
+        self.flush()
+
+    def update_prices(self, prices: dict):
+        """Batch update: stores new stock prices, then values each affected portfolio only once (`self.flush_prices`)
+        :param prices: dict of ticker: price
+        """
+        self.update_prices_batch(list(prices), fromiter(prices.values(), dtype=float64, count=len(prices)))
+
+    def update_prices_batch(self, tickers: Iterable, prices: Iterable):
+        """Same as `self.update_prices`, for aligned sequences, e.g. lists, ndarrays or DataFrame columns
+        :param tickers: repeated tickers are coalesced (last price kept)
+        :param prices: new price of each ticker
+        """
+        self.check_initialized()
+        stocks = [self.stocks[ticker] for ticker in tickers]
+        idxs = fromiter((stock.price_refidx for stock in stocks), dtype=intp, count=len(stocks))
+        values = asarray(prices, dtype=float64)
+        _, last = unique(idxs[::-1], return_index=True)
+        if len(last) < len(idxs):  # keep last occurrences, in input order
+            keep = sorted((len(idxs) - 1 - last).tolist())
+            stocks, idxs, values = [stocks[i] for i in keep], idxs[keep], values[keep]
+        was_nan = isnan(self.all_prices[idxs])
+        is_changed = self.set_prices(idxs, values)
+        changed = []
+        for i in flatnonzero(is_changed):  # bookkeeping of `Stock.price` setter, only for changed prices
+            stock = stocks[i]
+            stock._last = self.all_prices.item(stock.price_refidx)  # builtin float, rounded as stored
+            if was_nan[i] and stock._last == stock._last:
+                stock.count_first_price()
+            stock.print_value()
+            changed.append(stock)
+        if changed:
+            affected = unique(concatenate([stock.ancestor_ids for stock in changed]))  # sorted ids: topological order
+            self.dirty_mask[[owner_id for stock in changed for owner_id in stock.owner_ids]] = 1
+            self.flush_prices(affected)
+            self.end_update()
+
+    def set_prices(self, idxs: ndarray, values: ndarray) -> ndarray:
+        """Vectorized store into `self.all_prices`, instead of a scalar compare and store per `Component.price` setter
+        :param idxs: price refidx, see `self.all_refidx`
+        :return: boolean mask of changed prices (aligned with `idxs`)
+        """
+        values = values.astype(self.dtype, copy=False)  # compared at stored precision
+        is_changed = values != self.all_prices[idxs]
+        self.all_prices[idxs] = values
+        return is_changed
+
+    def reprice_all(self):
+        """Full revaluation of all portfolios from current prices in one batch, regardless of which prices changed.
+         For small and dense graphs with all prices present, a dense matrix-vector product (BLAS GEMV) per level of
+         nested portfolios, otherwise `self.flush_prices` of all portfolios"""
+        self.check_initialized()
+        # any NaN (stock or portfolio column) would spoil every row, as 0 * NaN is NaN
+        if self.dense_weights is not None and not isnan(self.all_prices).any():
+            old_prices = self.portfolio_prices.copy()
+            for lo, hi in zip(self.level_bounds[:-1], self.level_bounds[1:]):
+                self.portfolio_prices[lo:hi] = self.dense_weights[lo:hi] @ self.all_prices
+            self._report_prices(arange(len(self.portfolios)), old_prices)
+        else:
+            self.dirty_mask[:] = self.csr_indptr[1:] != self.csr_indptr[:-1]  # without components: NaN, as elsewhere
+            self.flush_prices()
+        self.end_update()
+
+    def check_initialized(self):
+        """Price updates need nodes and arrays of all components, i.e. `self.init_components` after the last
+         `self.add_component`"""
+        if self.topo_order is None:
+            raise RuntimeError("Components were added since (or before first) `init_components`, re-run it first")
+
+    def end_update(self):
+        """Output of a price update (or batch) is complete, written every `self.flush_every` updates"""
+        self.n_unflushed += 1
+        if self.n_unflushed >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Writes all buffered output, see `self.stdout`"""
+        self.stdout.flush()
+        self.n_unflushed = 0
+
+    def flush_prices(self, portfolio_ids: ndarray | None = None):
+        """Values portfolios affected by new prices (owners of updated stocks are flagged in `self.dirty_mask`) at once,
+         instead of a traversal (Python call per portfolio) per stock price update. With numba, a compiled single
+         sweep in topological order, otherwise as a sparse matrix-vector product (SpMV) of weights and all prices,
+         masked per level of nested portfolios (contiguous ids, see `self.level_bounds`) so that sub-portfolios are
+         valued first and each portfolio only once. Output is written by the caller, see `self.end_update`.
+         Portfolios lacking any price (NaN in the product) remain NaN.
+        :param portfolio_ids: sorted (i.e. in topological order), covering dirty portfolios and their ancestors
+        """
+        if portfolio_ids is None:
+            portfolio_ids = arange(len(self.portfolios))
+        old_prices = self.portfolio_prices[portfolio_ids]
+        if NUMBA_AVAILABLE:
+            revalue(self.csr_indptr, self.csr_assets, self.csr_weights, self.all_prices, portfolio_ids,
+                    self.dirty_mask, self.n_stocks, self.rcsr_indptr, self.rcsr_parents)
+        else:  # SpMV restricted to rows (and their weights) of dirty portfolios and (all) their ancestors
+            for portfolio_id in flatnonzero(self.dirty_mask):
+                self.dirty_mask[self.portfolios_list[portfolio_id].ancestor_ids] = 1
+            dirty = self.dirty_mask.view(bool)
+            for lo, hi in zip(self.level_bounds[:-1], self.level_bounds[1:]):  # ready: all sub-portfolios are valued
+                level = slice(self.csr_indptr[lo], self.csr_indptr[hi])  # rows (and their weights) of the level
+                entries = dirty[self.csr_rows[level]]
+                rows = self.csr_rows[level][entries] - lo
+                values = self.csr_weights[level][entries] * self.all_prices[self.csr_assets[level][entries]]
+                ready = dirty[lo:hi]
+                self.portfolio_prices[lo:hi][ready] = bincount(rows, weights=values, minlength=hi - lo)[ready]
+            self.dirty_mask[:] = 0
+        self._report_prices(portfolio_ids, old_prices)
+
+    def _report_prices(self, portfolio_ids: ndarray, old_prices: ndarray):
+        """Bookkeeping of `Component.price` setter (first prices and output) for portfolios valued in a batch"""
+        new_prices = self.portfolio_prices[portfolio_ids]
+        portfolios = self.portfolios_list
+        for portfolio_id in portfolio_ids[isnan(old_prices) & ~isnan(new_prices)]:  # valued for the first time
+            portfolios[portfolio_id].count_first_price()
+        if self.verbose:
+            for portfolio_id in portfolio_ids[(new_prices != old_prices) & ~isnan(new_prices)]:
+                portfolios[portfolio_id].print_value()
+
+    def dispose(self):
+        """Optional: breaks node-graph reference cycles (nodes keep a direct reference to the graph, not a weakref proxy),
+         so that memory is released without waiting for the cyclic garbage collector"""
+        for node in (*self.stocks.values(), *self.portfolios.values()):
+            node.graph = None
+        self.stocks, self.portfolios, self.portfolios_list = {}, {}, []
 
     @property
     def merged_view(self) -> tuple:
-        """Two adjaency lists: all nodes/components as combined dictionary and respectively all weights """
-        return ( ChainMap(self.adj_list_parents_portfolios, self.adj_list_parents_stocks),
-                 ChainMap(self.adj_list_parents_portfolio_weights, self.adj_list_parents_stock_weights) )
+        """Two adjaency lists: all nodes/components as combined dictionary and respectively all weights.
+        Cached as plain dicts (single lookup, and no insertion on missing keys unlike the `defaultdict` adjacency lists)
+         until adjacency lists change"""
+        if self._merged_view is None:
+            self._merged_view = ({**self.adj_list_parents_stocks, **self.adj_list_parents_portfolios},
+                                 {**self.adj_list_parents_stock_weights, **self.adj_list_parents_portfolio_weights})
+        return self._merged_view
 
     def fix_structure(self):
         """ Corrects adjacency lists that were built as data was "read in" (easier to distinguish
         stocks and portfolios on final set of related chunks of data) """
-        to_move = [node for node in self.adj_list_parents_stocks if node in self.adj_list_parents_portfolios]
+        to_move = self.adj_list_parents_stocks.keys() & self.adj_list_parents_portfolios.keys()  # C-level set op
+        if to_move:
+            self._merged_view = None
         for node in to_move:
-            parents = self.adj_list_parents_stocks.pop(node)
-            parent_weights = self.adj_list_parents_stock_weights.pop(node)
-            self.adj_list_parents_portfolios[node].extend(parents)
-            self.adj_list_parents_portfolio_weights[node].extend(parent_weights)
+            self.adj_list_parents_portfolios[node].extend(self.adj_list_parents_stocks.pop(node))
+            self.adj_list_parents_portfolio_weights[node].extend(self.adj_list_parents_stock_weights.pop(node))
 
     def init_components(self, est_risk_factors: bool | None = False):
         """Finalizes adjacency lists, and then creates a single central prices array maintained during valuations,
-             and in a Two-step process establishes nodes with edge (direct connectivity) info in them.
+             and in a single pass establishes nodes with edge (direct connectivity) info in them.
         :param est_risk_factors: establish risk factors, i.e. delta to ultimate underlying stocks by performing graph
          traversal to leave nodes and creating an array of deltas for each portfolio. Aka 2nd valuation approach.
         """
+        self.stock_deltas = None  # 1st approach, unless (re)built for the current graph below
         self.fix_structure()
+        self.parents, self.parent_weights = self.merged_view  # adjacency lists are final, single dict lookups
+        self._init_topo_order()  # portfolios are then numbered (ids, price refidx) in topological order
         self._init_prices()  # create a central prices array and map locating their tickers
-        # 2 steps: init all nodes, then "fill info about edges" (parents/children all initialized)
-        self._init_nodes()
-        self._link_nodes()  # this can be done with a reverse map, instead inverse relations are kept in nodes
+        self._init_nodes()  # nodes with edge info (owners), inverse relations are kept in CSR arrays
+        self._init_ancestors()  # cache affected portfolios for each node (used in 1st valuation approach)
         if est_risk_factors:
-            self.stock_deltas = zeros(shape=(len(self.portfolios), len(self.stocks)), dtype=float)
-            for stock_node in self.stocks.values():
-                stock_node.update_owners_deltas()
+            self._init_deltas()
+
+    def _init_deltas(self):
+        """Deltas of portfolios (rows) to stocks (columns), kept only for ancestors of each stock in compressed columns
+         (CSC): `self.stock_deltas` of affected portfolios (sorted ids, `self.delta_portfolios`) of each stock (by id,
+         `self.delta_indptr`), instead of a dense matrix. Each stock sweeps only its ancestors, not all nodes"""
+        n_entries = self.acsr_indptr[self.n_stocks]  # columns have the layout of ancestors of stocks
+        if NUMBA_AVAILABLE:  # compiled sweeps over reverse CSR arrays, stocks in parallel
+            values = propagate_all_deltas(self.n_stocks, self.acsr_indptr, self.acsr_ids, self.rcsr_indptr,
+                                          self.rcsr_parents, self.rcsr_weights)
+        else:
+            values = empty(n_entries, dtype=float64)
+            for stock_node, start, end in zip(self.stocks.values(), self.acsr_indptr[:-1].tolist(),
+                                              self.acsr_indptr[1:].tolist()):
+                stock_node.update_owners_deltas(values[start:end])
+        self.delta_indptr = self.acsr_indptr[:self.n_stocks + 1]
+        self.delta_portfolios = self.acsr_ids[:n_entries]
+        self.stock_deltas = values.astype(self.dtype, copy=False)
+        n_px_to_value = bincount(self.delta_portfolios, minlength=len(self.portfolios))  # stocks each portfolio needs
+        for portfolio, n_px in zip(self.portfolios_list, n_px_to_value.tolist()):
+            portfolio.n_px_to_value = n_px
 
     def _init_prices(self):
-        self.all_prices = full(len(self.merged_view[0]), nan)  # numpy array for efficient sum, ordered per dict
+        """Stock prices occupy `[0:n_stocks)` and portfolio prices `[n_stocks:)` (in topological order) of a single
+         prices array, so that portfolio prices are a contiguous (stride-1) view, see `self.portfolio_prices`"""
+        keys = list(self.adj_list_parents_stocks) + self.topo_order
+        self.all_prices = full(len(keys), nan, dtype=self.dtype)  # numpy array for efficient sum, ordered per dict
+        self.n_stocks = len(self.adj_list_parents_stocks)
+        self.portfolio_prices = self.all_prices[self.n_stocks:]  # view, indexed by portfolio id
         # map str tickers to int indices into numpy array.  done for clarity and easier debugging
-        self.all_refidx = {ticker: i for i, ticker in enumerate(self.merged_view[0].keys())}
+        self.all_refidx = dict(zip(keys, range(len(keys))))
 
     def _init_nodes(self):
-        for i, (name, owners) in enumerate(self.adj_list_parents_stocks.items()):
-            self.stocks[name] = Stock(name, idx=i, graph=proxy(self), price_refidx=self.all_refidx[name])
-        for i, (name, owners) in enumerate(self.adj_list_parents_portfolios.items()):
-            self.portfolios[name] = Portfolio(name, idx=i, graph=proxy(self), price_refidx=self.all_refidx[name])
-
-    def _link_nodes(self):
-        for name, stock in self.stocks.items():
-            for owner, w in zip(self.adj_list_parents_stocks[name], self.adj_list_parents_stock_weights[name]):
-                self.portfolios[owner].weights.append(w)
-                self.portfolios[owner].assets.append(stock.price_refidx)
-        for name, portfolio in self.portfolios.items():
-            for owner, w in zip(self.adj_list_parents_portfolios[name], self.adj_list_parents_portfolio_weights[name]):
-                self.portfolios[owner].weights.append(w)
-                self.portfolios[owner].assets.append(portfolio.price_refidx)
+        """Creates nodes and, in the same pass over adjacency lists, fills contiguous arrays of portfolio assets (price
+         refidx) and weights (CSR sparse matrix layout: portfolios by id in rows, all prices by refidx in columns),
+         preallocated as number of edges is known from adjacency lists. Each portfolio keeps a slice (and views) into
+         them. Owner ids follow from price refidx (see `self._init_prices`), so owners need not be created first"""
+        n_stocks, refidx = self.n_stocks, self.all_refidx
+        n_assets = [0] * len(self.topo_order)
+        for owners in self.parents.values():
+            for owner in owners:
+                n_assets[refidx[owner] - n_stocks] += 1
+        self.csr_indptr = concatenate(([0], cumsum(n_assets))).astype(intp)  # rows start/end
+        self.csr_assets = empty(self.csr_indptr[-1], dtype=intp)  # columns, intp: no index conversion on gather
+        self.csr_weights = empty(self.csr_indptr[-1], dtype=self.dtype)
+        cursor = self.csr_indptr[:-1].tolist()  # next position to fill in each row (portfolio)
+
+        nodes = [None] * len(refidx)  # by price refidx: stocks, then portfolios by id (in topological order)
+        for name, owners in self.parents.items():
+            i = refidx[name]
+            if i < n_stocks:
+                node = Stock(name, idx=i, graph=self, price_refidx=i)
+            else:
+                node = Portfolio(name, idx=i - n_stocks, graph=self, price_refidx=i)
+            for owner, w in zip(owners, self.parent_weights[name]):
+                owner_id = refidx[owner] - n_stocks
+                self.csr_assets[cursor[owner_id]], self.csr_weights[cursor[owner_id]] = i, w
+                cursor[owner_id] += 1
+                node.owner_ids.append(owner_id)
+            nodes[i] = node
+        self.stocks = {node.name: node for node in nodes[:n_stocks]}
+        self.portfolios_list = nodes[n_stocks:]  # to locate portfolios by id
+        self.portfolios = {node.name: node for node in self.portfolios_list}
+
+        # reverse adjacency (CSR) by price refidx (rows are stocks then portfolios): parents (refidx) and weights
+        self.rcsr_indptr = concatenate(([0], cumsum([len(node.owner_ids) for node in nodes]))).astype(intp)
+        self.rcsr_parents = array([n_stocks + i for node in nodes for i in node.owner_ids], dtype=intp)
+        self.rcsr_weights = array([w for node in nodes for w in self.parent_weights[node.name]], dtype=float64)
+
+        for portfolio, start, end in zip(self.portfolios_list, self.csr_indptr[:-1], self.csr_indptr[1:]):
+            portfolio.slice = slice(start, end)
+            portfolio.assets, portfolio.weights = self.csr_assets[portfolio.slice], self.csr_weights[portfolio.slice]
+            portfolio.n_nan_inputs = int(end - start)  # all prices are missing at initialization
+        self.csr_rows = repeat(arange(len(self.portfolios)), n_assets)  # portfolio id of each weight, for SpMV
+        self.scratch = empty(max(n_assets, default=0), dtype=self.dtype)  # gathered prices, see `Portfolio.update_value`
+        n_entries = len(self.portfolios_list) * len(refidx)
+        if n_entries * self.csr_weights.itemsize <= 1 << 20 and len(self.csr_weights) > 0.1 * n_entries:
+            self.dense_weights = zeros((len(self.portfolios_list), len(refidx)), dtype=self.dtype)  # fits in L2 cache
+            add.at(self.dense_weights, (self.csr_rows, self.csr_assets), self.csr_weights)  # repeated edges are summed
+        else:
+            self.dense_weights = None
+
+    def _init_topo_order(self):
+        """Kahn's algorithm (toposort) over portfolios (names), sub-portfolios are ordered before their owners.
+        Graph traversal is done only once at initialization instead of BFS discovery on every price update.
+        Catches cycles."""
+        n_subportfolios = dict.fromkeys(self.adj_list_parents_portfolios, 0)  # in-degree: number of sub-portfolios
+        for owners in self.adj_list_parents_portfolios.values():
+            for owner in owners:
+                n_subportfolios[owner] += 1
+        queue = deque(name for name, n in n_subportfolios.items() if n == 0)  # own only stocks
+        topo_order = []
+        while queue:
+            name = queue.popleft()
+            topo_order.append(name)
+            for owner in self.adj_list_parents_portfolios[name]:
+                n_subportfolios[owner] -= 1
+                if n_subportfolios[owner] == 0:  # all sub-portfolios are ordered before their owner
+                    queue.append(owner)
+        if len(topo_order) != len(self.adj_list_parents_portfolios):
+            raise ValueError(f"Cycle in portfolio definitions involving: "
+                             f"{set(self.adj_list_parents_portfolios) - set(topo_order)}")
+
+        levels = dict.fromkeys(topo_order, 1)  # number of nested levels of each portfolio (only stocks => 1)
+        for name in topo_order:
+            for owner in self.adj_list_parents_portfolios[name]:
+                levels[owner] = max(levels[owner], levels[name] + 1)
+        self.depth = max(levels.values(), default=0)
+        topo_order.sort(key=levels.get)  # still topological (owners are at higher levels), levels are contiguous
+        self.level_bounds = cumsum(bincount(list(levels.values()), minlength=self.depth + 1)).tolist()  # none at 0
+        self.topo_order = topo_order
+
+    def _init_ancestors(self):
+        """Caches ancestors of every node in topological order (i.e. sorted portfolio ids, see `self._init_nodes`)"""
+        ancestors = {}  # ids of all (direct and indirect) owners, filled top-down (reversed topological order)
+        for portfolio in reversed(self.portfolios_list):
+            ancestors[portfolio.id] = set(portfolio.owner_ids)
+            for owner_id in portfolio.owner_ids:
+                ancestors[portfolio.id] |= ancestors[owner_id]
+        nodes = (*self.stocks.values(), *self.portfolios_list)  # by price refidx
+        node_ancestors = []
+        for node in nodes:
+            ancestor_ids = set(node.owner_ids)
+            for owner_id in node.owner_ids:
+                ancestor_ids |= ancestors[owner_id]
+            node_ancestors.append(sorted(ancestor_ids))
+        # ancestors (CSR) by price refidx, each node keeps a view, see `_kernels.propagate_all_deltas`
+        self.acsr_indptr = concatenate(([0], cumsum([len(ids) for ids in node_ancestors]))).astype(intp)
+        self.acsr_ids = array([i for ids in node_ancestors for i in ids], dtype=intp)
+        for node, start, end in zip(nodes, self.acsr_indptr[:-1].tolist(), self.acsr_indptr[1:].tolist()):
+            node.ancestor_ids = self.acsr_ids[start:end]
+            node.ancestors_topo = [self.portfolios_list[i] for i in node.ancestor_ids.tolist()]
+        self.dirty_mask = zeros(len(self.portfolios), dtype=uint8)  # affected by new prices, see `self.flush_prices`
@@ -0,0 +1,149 @@
+"""Regression tests against a brute-force valuation, run with `python -m unittest` (from this directory).
+Compiled (numba) cases are skipped unless numba is installed"""
+import io
+import math
+import random
+import unittest
+from unittest import mock
+
+import portfolio_tool
+from portfolio_tool import AssetGraph
+from _kernels import NUMBA_AVAILABLE
+
+NUMBA_MODES = (False, True) if NUMBA_AVAILABLE else (False,)
+
+
+def reference_prices(edges, stock_prices):
+    """Brute-force (recursive) values of all portfolios, NaN if any (direct or indirect) component lacks a price
+    :param edges: (name, qty, parent) of each component
+    :param stock_prices: dict of ticker: price
+    """
+    assets = {}
+    for name, qty, parent in edges:
+        assets.setdefault(parent, []).append((name, qty))
+
+    def value(name):
+        if name not in assets:  # stock
+            return stock_prices.get(name, math.nan)
+        if not assets[name]:  # declared without components
+            return math.nan
+        return sum(qty * value(asset) for asset, qty in assets[name])
+    return {name: value(name) for name in assets}
+
+
+def random_edges(seed, n_stocks=20, n_levels=3, per_level=5):
+    """Nested portfolios, incl. stocks held both directly and via sub-portfolios, and a portfolio without components"""
+    rnd = random.Random(seed)
+    stocks = [f"S{i}" for i in range(n_stocks)]
+    portfolios, edges = ["EMPTY"], []
+    for level in range(n_levels):
+        layer = [f"P{level}_{j}" for j in range(per_level)]
+        for portfolio in layer:
+            for name in rnd.sample(stocks, rnd.randint(1, 4)) + rnd.sample(portfolios, min(len(portfolios), 2)):
+                edges.append((name, float(rnd.randint(1, 9)), portfolio))
+        portfolios += layer
+    return stocks, portfolios, edges
+
+
+def build(edges, portfolios=(), **kwargs):
+    graph = AssetGraph(stdout=io.StringIO(), **kwargs)
+    for portfolio in portfolios:
+        graph.add_component(portfolio)
+    for name, qty, parent in edges:
+        graph.add_component(name, qty, parent)
+    return graph
+
+
+def last_output(graph):
+    """Last printed price of each name"""
+    return {name: float(price) for name, price in (line.split(',') for line in graph.stdout.getvalue().splitlines())}
+
+
+class TestValuation(unittest.TestCase):
+
+    def assertPricesEqual(self, graph, expected):
+        for name, price in expected.items():
+            actual = float(graph.portfolios[name].price)
+            if math.isnan(price):
+                self.assertTrue(math.isnan(actual), name)
+            else:
+                self.assertTrue(math.isclose(actual, price, rel_tol=1e-9), f"{name}: {actual} != {price}")
+
+    def test_multi_path_delta(self):
+        # AAPL is held directly by INDUSTRIALS and via TECH, its delta to INDUSTRIALS is 2 * 100 + 1
+        edges = [("AAPL", 100, "TECH"), ("MSFT", 200, "TECH"), ("TECH", 2, "INDUSTRIALS"), ("AAPL", 1, "INDUSTRIALS")]
+        for use_numba in NUMBA_MODES:
+            for est_risk_factors in (False, True):
+                with self.subTest(use_numba=use_numba, est_risk_factors=est_risk_factors), \
+                        mock.patch.object(portfolio_tool, 'NUMBA_AVAILABLE', use_numba):
+                    graph = build(edges, ["TECH", "INDUSTRIALS"])
+                    graph.init_components(est_risk_factors=est_risk_factors)
+                    graph.stocks["AAPL"].update_value(10)
+                    graph.stocks["MSFT"].update_value(1)
+                    self.assertPricesEqual(graph, {"TECH": 1200.0, "INDUSTRIALS": 2410.0})
+                    graph.stocks["AAPL"].update_value(11)
+                    self.assertPricesEqual(graph, {"TECH": 1300.0, "INDUSTRIALS": 2611.0})
+                    self.assertEqual(last_output(graph)["INDUSTRIALS"], 2611.0)
+
+    def test_mixed_updates(self):
+        # per-line updates, batches (dicts and marked stream) and full revaluations interleaved
+        for use_numba in NUMBA_MODES:
+            for est_risk_factors in (False, True):
+                for seed in range(5):
+                    with self.subTest(use_numba=use_numba, est_risk_factors=est_risk_factors, seed=seed), \
+                            mock.patch.object(portfolio_tool, 'NUMBA_AVAILABLE', use_numba):
+                        stocks, portfolios, edges = random_edges(seed)
+                        graph = build(edges, portfolios)
+                        graph.init_components(est_risk_factors=est_risk_factors)
+                        rnd, prices, held = random.Random(seed), {}, sorted(graph.stocks)
+                        for step in range(40):
+                            ticks = [(rnd.choice(held[:-2]), float(rnd.randint(1, 500)))  # 2 stocks stay NaN
+                                     for _ in range(rnd.randint(1, 6))]
+                            mode = step % 4
+                            if mode == 0:
+                                for ticker, price in ticks:
+                                    graph.stocks[ticker].update_value(price)
+                            elif mode == 1:
+                                graph.update_prices(dict(ticks))
+                            elif mode == 2:
+                                graph.update_prices_from([*ticks, None], batched=True)
+                            else:
+                                graph.update_prices(dict(ticks))
+                                graph.reprice_all()
+                            prices.update(ticks)
+                            self.assertPricesEqual(graph, reference_prices(edges, prices))
+                        for name, price in last_output(graph).items():
+                            node = graph.stocks.get(name) or graph.portfolios[name]
+                            self.assertEqual(price, float(node.price), name)
+
+    def test_from_arrays(self):
+        stocks, portfolios, edges = random_edges(0)
+        expected = build(edges, portfolios)
+        expected.init_components()
+        names, qtys, parents = zip(*edges)
+        graph = AssetGraph.from_arrays(names, qtys, parents, portfolios=portfolios, stdout=io.StringIO())
+        graph.init_components()
+        self.assertEqual(set(graph.stocks), set(expected.stocks))
+        self.assertEqual(set(graph.portfolios), set(expected.portfolios))
+        self.assertEqual({name: sorted(owners) for name, owners in graph.parents.items()},
+                         {name: sorted(owners) for name, owners in expected.parents.items()})
+        AssetGraph.from_arrays([], [], []).init_components()  # no edges
+
+    def test_cycle(self):
+        graph = build([("A", 1, "P"), ("P", 1, "Q"), ("Q", 1, "P")], ["P", "Q"])
+        with self.assertRaises(ValueError):
+            graph.init_components()
+
+    def test_float32_output(self):
+        for est_risk_factors in (False, True):
+            with self.subTest(est_risk_factors=est_risk_factors):
+                graph = build([("A", 1, "T")], ["T"], dtype='float32')
+                graph.init_components(est_risk_factors=est_risk_factors)
+                graph.stocks["A"].update_value(43.29)
+                self.assertEqual(graph.stdout.getvalue().splitlines(), ["A,43.29", "T,43.29"])
+        with self.assertRaises(ValueError):
+            AssetGraph(dtype='float16')
+
+
+if __name__ == '__main__':
+    unittest.main()